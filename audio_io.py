@@ -0,0 +1,85 @@
+from typing import List
+from math import gcd
+import os
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+import torch
+from scipy.signal import resample_poly
+from torch.utils.data import DataLoader
+from torchvision.transforms.transforms import Compose
+import pandas as pd
+
+from vistec_ser.data.ser_slice_dataset import SERInferenceDataset
+from vistec_ser.data.features.transform import FilterBank
+
+CHANNELS = 1
+
+
+def ffmpeg_capture_args(sampling_rate: int) -> List[str]:
+    """ffmpeg output options that write mono PCM at the model's sampling rate."""
+    return ["-ar", str(sampling_rate), "-ac", str(CHANNELS)]
+
+
+def to_mono(audio: np.ndarray, orig_rate: int, sampling_rate: int) -> np.ndarray:
+    """Downmix a (frames, channels) array and resample it to `sampling_rate`."""
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+    if orig_rate != sampling_rate:
+        g = gcd(orig_rate, sampling_rate)
+        audio = resample_poly(audio, sampling_rate // g, orig_rate // g)
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+
+def load_audio(audio_path: str, sampling_rate: int) -> np.ndarray:
+    """Decode an audio file into mono float32 PCM at `sampling_rate`."""
+    audio, orig_rate = sf.read(audio_path, dtype="float32", always_2d=True)
+    if audio.shape[1] != CHANNELS or orig_rate != sampling_rate:
+        print(f"{os.path.basename(audio_path)}: {audio.shape[1]}ch @ {orig_rate}Hz, "
+              f"converting to {CHANNELS}ch @ {sampling_rate}Hz")
+    return to_mono(audio, orig_rate, sampling_rate)
+
+
+class MonoInferenceDataset(SERInferenceDataset):
+    """SERInferenceDataset that decodes through `load_audio` instead of sox."""
+
+    def _load_feature(self, audio_path: str) -> torch.Tensor:
+        return torch.from_numpy(load_audio(audio_path, self.sampling_rate)).unsqueeze(0)
+
+
+def extract_feature(thaiser_module, audio_paths: List[str]) -> DataLoader:
+    """Drop-in for `ThaiSERDataModule.extract_feature` using the mono decode path."""
+    if isinstance(audio_paths, str):
+        audio_paths = [audio_paths]
+    audio_df = pd.DataFrame([[a] for a in audio_paths], columns=["PATH"])
+    transform = Compose([
+        FilterBank(
+            frame_length=thaiser_module.frame_length,
+            frame_shift=thaiser_module.frame_shift,
+            num_mel_bins=thaiser_module.num_mel_bins,
+            sample_frequency=thaiser_module.sampling_rate
+        )
+    ])
+    feature_dataset = MonoInferenceDataset(
+        csv_file=audio_df,
+        sampling_rate=thaiser_module.sampling_rate,
+        max_len=thaiser_module.max_len,
+        center_feats=thaiser_module.center_feats,
+        scale_feats=thaiser_module.scale_feats,
+        transform=transform
+    )
+    return DataLoader(feature_dataset, batch_size=1, num_workers=thaiser_module.num_workers)
+
+
+if __name__ == "__main__":
+    # usage: python audio_io.py <sampling_rate> clip1.wav [clip2.wav ...]
+    target_rate = int(sys.argv[1])
+    for path in sys.argv[2:]:
+        info = sf.info(path)
+        t0 = time.perf_counter()
+        pcm = load_audio(path, target_rate)
+        elapsed = time.perf_counter() - t0
+        print(f"{path}: {info.channels}ch @ {info.samplerate}Hz, {os.path.getsize(path)} bytes on disk, "
+              f"{pcm.nbytes} bytes decoded, {elapsed * 1000:.1f} ms")
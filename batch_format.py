@@ -0,0 +1,54 @@
+from typing import Dict, List, Tuple
+import json
+import struct
+import time
+
+import numpy as np
+
+# Layout: uint32 LE header length | UTF-8 JSON header {"names", "emotions", "shape"} |
+# float32 LE probability matrix of `shape` (clips x emotions), values in [0, 1].
+BATCH_MEDIA_TYPE = "application/x-ser-batch"
+_HEADER_LEN = struct.Struct("<I")
+
+
+def encode_batch(names: List[str], emotions: List[str], probs: np.ndarray) -> bytes:
+    probs = np.ascontiguousarray(probs, dtype="<f4")
+    assert probs.shape == (len(names), len(emotions)), probs.shape
+    header = json.dumps({"names": names, "emotions": emotions, "shape": probs.shape}).encode()
+    return _HEADER_LEN.pack(len(header)) + header + probs.tobytes()
+
+
+def decode_batch(payload: bytes) -> Tuple[List[str], List[str], np.ndarray]:
+    (header_len,) = _HEADER_LEN.unpack_from(payload)
+    offset = _HEADER_LEN.size + header_len
+    header = json.loads(payload[_HEADER_LEN.size:offset])
+    probs = np.frombuffer(payload, dtype="<f4", offset=offset).reshape(header["shape"])
+    return header["names"], header["emotions"], probs
+
+
+def to_json_records(names: List[str], emotions: List[str], probs: np.ndarray) -> List[Dict]:
+    """The `/predict` JSON shape: one `{"name", "prob": {emotion: percent string}}` per clip."""
+    return [{"name": name, "prob": {emotion: f"{p * 100:.2f}" for emotion, p in zip(emotions, row)}}
+            for name, row in zip(names, probs.tolist())]
+
+
+if __name__ == "__main__":
+    n_clips = 1000
+    emotions = ["neutral", "anger", "happiness", "sadness", "frustration"]
+    names = [f"clip_{i:04d}.wav" for i in range(n_clips)]
+    probs = np.random.default_rng(0).dirichlet(np.ones(len(emotions)), size=n_clips).astype(np.float32)
+
+    def bench(fn, n_iter=20):
+        t0 = time.perf_counter()
+        for _ in range(n_iter):
+            out = fn()
+        return out, (time.perf_counter() - t0) / n_iter * 1000
+
+    json_payload, json_encode = bench(lambda: json.dumps(to_json_records(names, emotions, probs)).encode())
+    _, json_decode = bench(lambda: [list(map(float, item["prob"].values())) for item in json.loads(json_payload)])
+    bin_payload, bin_encode = bench(lambda: encode_batch(names, emotions, probs))
+    _, bin_decode = bench(lambda: decode_batch(bin_payload))
+
+    print(f"{n_clips} clips x {len(emotions)} emotions")
+    print(f"json   {len(json_payload):8d} bytes  encode {json_encode:6.2f} ms  parse {json_decode:6.2f} ms")
+    print(f"binary {len(bin_payload):8d} bytes  encode {bin_encode:6.2f} ms  parse {bin_decode:6.2f} ms")
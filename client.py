@@ -1,11 +1,21 @@
 import subprocess
+import sys
 import requests
 import os
+import yaml
 from pydub import AudioSegment
 import cv2
+from batch_format import BATCH_MEDIA_TYPE, decode_batch, to_json_records
 
-RATE = 16000
-CHANNELS = 2
+CONFIG_PATH = 'config.yaml'
+
+def load_sampling_rate(config_path: str = CONFIG_PATH) -> int:
+    """The model's `feature.sampling_rate`, so recordings reach the server without resampling."""
+    with open(config_path) as f:
+        return yaml.safe_load(f)['feature']['sampling_rate']
+
+RATE = load_sampling_rate()
+CHANNELS = 1
 TEMP_DIR = 'temp'
 WAVE_OUTPUT_PATH = TEMP_DIR +'/recorded_audio.wav'
 WAVE_OUTPUT_FILENAME = "recorded_audio.wav"
@@ -62,6 +72,19 @@ def send_audio_to_server(audio_filename: str, server_url: str):
         response = requests.post(server_url, files=files)
         return response
 
+def send_audio_batch_to_server(audio_filenames, server_url: str):
+    """Send many audio files in one POST to `/predict_batch`, asking for the binary batch format."""
+    for f in audio_filenames:
+        if not os.path.exists(f):
+            print(f"Audio file {f} does not exist.")
+    files = [('audios', (os.path.basename(f), open(f, 'rb'), 'audio/wav'))
+             for f in audio_filenames if os.path.exists(f)]
+    try:
+        return requests.post(server_url, files=files, headers={'Accept': BATCH_MEDIA_TYPE})
+    finally:
+        for _, (_, audio_file, _) in files:
+            audio_file.close()
+
 def process_audio_with_pydub(audio_filename: str):
     """Use pydub to load and process the audio file."""
     if not os.path.exists(audio_filename):
@@ -97,7 +120,10 @@ def start_recording_session():
 def display_server_response(response):
     """Display the server response in the desired format."""
     try:
-        json_response = response.json()
+        if response.headers.get('content-type', '').startswith(BATCH_MEDIA_TYPE):
+            json_response = to_json_records(*decode_batch(response.content))
+        else:
+            json_response = response.json()
         for item in json_response:
             print(f"Name: {item['name']}")
             print("Probabilities:")
@@ -127,4 +153,9 @@ def stressed_or_not(response):
 
 
 if __name__ == "__main__":
-    start_recording_session()
+    if len(sys.argv) > 1:
+        # python client.py a.wav b.wav ... sends the files as one /predict_batch request
+        response = send_audio_batch_to_server(sys.argv[1:], "http://localhost:8000/predict_batch")
+        display_server_response(response)
+    else:
+        start_recording_session()
@@ -1,6 +1,11 @@
+import argparse
 import cv2
 import mediapipe as mp
+import json
 import math
+import os
+import socket
+import sys
 import numpy as np
 import time
 import asyncio
@@ -15,6 +20,8 @@ import torch.nn.functional as F
 from PIL import Image
 from torchvision import transforms
 
+import tracing
+
 SER_SERVER_URL = 'http://127.0.0.1:8000'
 
 class RateLimiter:
@@ -271,26 +278,20 @@ async def get_ser_prediction(session, rate_limiter):
     try:
         # Try to acquire permission to make a request
         if await rate_limiter.acquire():
-            async with session.get(f"{SER_SERVER_URL}/get_latest_prediction") as response:
-                if response.status == 200:
-                    prediction_result = await response.json()
-                    return prediction_result, None
+            with tracing.span('ser_poll'):
+                async with session.get(f"{SER_SERVER_URL}/get_latest_prediction") as response:
+                    if response.status == 200:
+                        prediction_result = await response.json()
+                        return prediction_result, None
         # Return remaining time until next request
         return None, rate_limiter.time_until_next_request()
     except Exception as e:
-        print(f"Error getting SER prediction: {str(e)}")
+        print(f"Error getting SER prediction: {str(e)}", file=sys.stderr)
         return None, None
 
-async def main():
-    # Initialize rate limiter for 1 request every 15 seconds
-    rate_limiter = RateLimiter(interval_seconds=3)
-    
-    mp_face_mesh = mp.solutions.face_mesh
+DICT_EMO = {0: 'Neutral', 1: 'Happiness', 2: 'Sadness', 3: 'Surprise', 4: 'Fear', 5: 'Disgust', 6: 'Anger'}
 
-    name_backbone_model = 'models/FER_static_ResNet50_AffectNet.pt'
-    name_LSTM_model = 'Aff-Wild2'
-
-    # Load models
+def load_fer_models(name_backbone_model='models/FER_static_ResNet50_AffectNet.pt', name_LSTM_model='Aff-Wild2'):
     pth_backbone_model = ResNet50(7, channels=3)
     pth_backbone_model.load_state_dict(torch.load(name_backbone_model))
     pth_backbone_model.eval()
@@ -298,80 +299,338 @@ async def main():
     pth_LSTM_model = LSTMPyTorch()
     pth_LSTM_model.load_state_dict(torch.load('models/FER_dinamic_LSTM_{0}.pt'.format(name_LSTM_model)))
     pth_LSTM_model.eval()
-
-    DICT_EMO = {0: 'Neutral', 1: 'Happiness', 2: 'Sadness', 3: 'Surprise', 4: 'Fear', 5: 'Disgust', 6: 'Anger'}
-
-    async with aiohttp.ClientSession() as session:
-        cap = cv2.VideoCapture(1)
-        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = np.round(cap.get(cv2.CAP_PROP_FPS))
-        lstm_features = []
-        last_ser_prediction = {'prediction': {'name': 'temp'}}
-
-        with mp.solutions.face_mesh.FaceMesh(min_detection_confidence=0.5) as face_mesh:
-            while cap.isOpened():
-                t1 = time.time()
-                success, frame = cap.read()
-                if frame is None:
-                    break
-
-                frame_copy = frame.copy()
-                frame_copy.flags.writeable = False
-                frame_copy = cv2.cvtColor(frame_copy, cv2.COLOR_BGR2RGB)
-                results = face_mesh.process(frame_copy)
-                frame_copy.flags.writeable = True
-
-                if results.multi_face_landmarks:
-                    for fl in results.multi_face_landmarks:
-                        startX, startY, endX, endY = get_box(fl, w, h)
-                        cur_face = frame_copy[startY:endY, startX:endX]
-
-                        cur_face = pth_processing(Image.fromarray(cur_face))
-                        features = torch.nn.functional.relu(pth_backbone_model.extract_features(cur_face)).detach().numpy()
-
-                        if len(lstm_features) == 0:
-                            lstm_features = [features] * 10
-                        else:
-                            lstm_features = lstm_features[1:] + [features]
-
-                        lstm_f = torch.from_numpy(np.vstack(lstm_features))
-                        lstm_f = torch.unsqueeze(lstm_f, 0)
-                        output = pth_LSTM_model(lstm_f).detach().numpy()
-
-                        cl = np.argmax(output)
-                        label = DICT_EMO[cl]
-                        frame = display_EMO_PRED(frame, (startX, startY, endX, endY), 
-                                               label + ' {0:.1%}'.format(output[0][cl]), 
-                                               line_width=3)
-
+    return pth_backbone_model, pth_LSTM_model
+
+def open_capture(source):
+    """Open a camera index, a video file or a directory of frames (read in sorted order)."""
+    if isinstance(source, int) or str(source).isdigit():
+        return cv2.VideoCapture(int(source))
+    if os.path.isdir(source):
+        return FrameDirectoryCapture(source)
+    return cv2.VideoCapture(source)
+
+class FrameDirectoryCapture:
+    """Minimal cv2.VideoCapture look-alike over a directory of image files."""
+    EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+    def __init__(self, directory, fps=30):
+        self.paths = sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                            if f.lower().endswith(self.EXTENSIONS))
+        self.index = 0
+        self.fps = fps
+
+    def isOpened(self):
+        return self.index < len(self.paths)
+
+    def read(self):
+        if not self.isOpened():
+            return False, None
+        frame = cv2.imread(self.paths[self.index])
+        self.index += 1
+        return frame is not None, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.paths)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            # timestamp of the frame last returned by `read`, like VideoCapture
+            return max(0, self.index - 1) * 1000 / self.fps
+        return 0
+
+    def release(self):
+        self.index = len(self.paths)
+
+class FeatureReuse:
+    """Change detector deciding when backbone features of the previous face crop can be reused.
+
+    The preprocessed 224x224 crop is subsampled every `stride` pixels and compared with the
+    crop the cached features were computed from; if the mean absolute difference (in pixel
+    units, 0-255) is below `threshold` the cached features are returned. `threshold=0`
+    disables reuse. With `verify=True` the backbone still runs on every frame and the LSTM
+    also runs on a history of fresh features, so the agreement of the emitted label with
+    the label that would have been emitted without reuse can be reported.
+    """
+    def __init__(self, threshold=0.0, stride=7, verify=False):
+        self.threshold = threshold
+        self.stride = stride
+        self.verify = verify
+        self.reference = None
+        self.features = None
+        self.frames = 0
+        self.skipped = 0
+        self.verified = 0
+        self.agreed = 0
+
+    def lookup(self, face):
+        self.frames += 1
+        if self.threshold <= 0 or self.features is None:
+            return None
+        thumb = face[0, :, ::self.stride, ::self.stride]
+        if (thumb - self.reference).abs().mean().item() < self.threshold:
+            self.skipped += 1
+            return self.features
+        return None
+
+    def update(self, face, features):
+        if self.threshold > 0:
+            self.reference = face[0, :, ::self.stride, ::self.stride]
+            self.features = features
+
+    def record_agreement(self, agreed):
+        self.verified += 1
+        self.agreed += int(agreed)
+
+    def stats(self):
+        return {
+            'threshold': self.threshold,
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'skip_rate': self.skipped / self.frames if self.frames else 0.0,
+            'agreement': self.agreed / self.verified if self.verified else None,
+        }
+
+def push_history(history, features, length=10):
+    """Slide `features` into the LSTM input window, filling it on the first frame."""
+    if len(history) == 0:
+        return [features] * length
+    return history[1:] + [features]
+
+class FERPipeline:
+    """Face mesh -> pth_processing -> backbone -> LSTM for one frame at a time.
+
+    `timer`, if given, must provide `stage(name)` returning a context manager; it is
+    entered around each stage so callers can measure them without changing the loop.
+    `reuse` is an optional FeatureReuse that lets near-identical crops skip the backbone.
+    With `service` (a fer_service.FERServiceClient) the backbone and LSTM run in the shared
+    FER service instead, and the local models may be None.
+    """
+    def __init__(self, backbone_model, lstm_model, face_mesh, timer=None, reuse=None, service=None):
+        self.backbone_model = backbone_model
+        self.lstm_model = lstm_model
+        self.face_mesh = face_mesh
+        self.timer = timer
+        self.reuse = reuse or FeatureReuse()
+        self.service = service
+        self.lstm_features = []
+        self.fresh_lstm_features = []
+
+    def stage(self, name):
+        return self.timer.stage(name) if self.timer is not None else tracing.span(name)
+
+    def process(self, frame):
+        """Return a list of ((startX, startY, endX, endY), output) for every face in `frame`."""
+        h, w = frame.shape[:2]
+        detections = []
+        with self.stage('face_mesh'):
+            # cvtColor allocates a new array, so `frame` itself is never touched
+            frame_copy = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frame_copy.flags.writeable = False
+            results = self.face_mesh.process(frame_copy)
+            frame_copy.flags.writeable = True
+
+        if results.multi_face_landmarks and self.service is not None:
+            boxes = [get_box(fl, w, h) for fl in results.multi_face_landmarks]
+            with self.stage('fer_service'):
+                try:
+                    outputs = self.service.infer([(i, frame_copy[startY:endY, startX:endX])
+                                                  for i, (startX, startY, endX, endY) in enumerate(boxes)])
+                except (RuntimeError, TimeoutError) as e:
+                    # a slow or restarting service costs this frame only; `infer` reclaims its slots
+                    print(f"FER service error: {e}", file=sys.stderr)
+                    return []
+            return list(zip(boxes, outputs))
+
+        if results.multi_face_landmarks:
+            for fl in results.multi_face_landmarks:
+                startX, startY, endX, endY = get_box(fl, w, h)
+                cur_face = frame_copy[startY:endY, startX:endX]
+
+                with self.stage('pth_processing'):
+                    cur_face = pth_processing(Image.fromarray(cur_face))
+                features = self.reuse.lookup(cur_face)
+                if features is None or self.reuse.verify:
+                    with self.stage('backbone'):
+                        fresh = torch.nn.functional.relu(self.backbone_model.extract_features(cur_face)).detach().numpy()
+                    if features is None:
+                        features = fresh
+                        self.reuse.update(cur_face, features)
+
+                with self.stage('lstm'):
+                    self.lstm_features = push_history(self.lstm_features, features)
+                    output = self.run_lstm(self.lstm_features)
+                if self.reuse.verify:
+                    # what the LSTM would have emitted had the backbone never been skipped
+                    self.fresh_lstm_features = push_history(self.fresh_lstm_features, fresh)
+                    fresh_output = self.run_lstm(self.fresh_lstm_features)
+                    self.reuse.record_agreement(np.argmax(output) == np.argmax(fresh_output))
+                detections.append(((startX, startY, endX, endY), output))
+        return detections
+
+    def run_lstm(self, history):
+        lstm_f = torch.from_numpy(np.vstack(history))
+        lstm_f = torch.unsqueeze(lstm_f, 0)
+        return self.lstm_model(lstm_f).detach().numpy()
+
+    def render(self, frame, detections):
+        with self.stage('render'):
+            for box, output in detections:
+                cl = np.argmax(output)
+                label = DICT_EMO[cl]
+                frame = display_EMO_PRED(frame, box, label + ' {0:.1%}'.format(output[0][cl]), line_width=3)
+        return frame
+
+class JsonlSink:
+    """Buffered JSON-lines writer to a file path, `-` for stdout, or `tcp://host:port`."""
+    def __init__(self, target, buffer_size=1 << 16):
+        self.sock = None
+        if target == '-':
+            self.file = sys.stdout
+        elif target.startswith('tcp://'):
+            host, port = target[len('tcp://'):].rsplit(':', 1)
+            self.sock = socket.create_connection((host, int(port)))
+            self.file = self.sock.makefile('w', buffering=buffer_size, encoding='utf-8')
+        else:
+            self.file = open(target, 'w', buffering=buffer_size, encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def close(self):
+        self.file.flush()
+        if self.file is not sys.stdout:
+            self.file.close()
+        if self.sock is not None:
+            self.sock.close()
+
+def ser_label(ser_prediction):
+    """Top emotion of a `/get_latest_prediction` response, or None before the first prediction."""
+    prediction = ser_prediction['prediction']
+    if prediction is None or 'prob' not in prediction:
+        return None
+    return max(prediction['prob'], key=lambda emotion: float(prediction['prob'][emotion]))
+
+def face_records(frame_index, ts, detections, ser):
+    for face, (box, output) in enumerate(detections):
+        yield {
+            'ts': ts,
+            'frame': frame_index,
+            'face': face,
+            'box': [int(v) for v in box],
+            'fer': {DICT_EMO[i]: round(float(p), 5) for i, p in enumerate(output[0])},
+            'ser': ser,
+        }
+
+async def main(source=1, skip_threshold=0.0, fer_service=None, headless=False, jsonl=None):
+    """Run the webcam client.
+
+    `headless` skips every overlay, window and `cv2.waitKey`, so video files are processed
+    as fast as the pipeline allows. `jsonl` streams one record per frame and face to a
+    file, `-` or `tcp://host:port`; timestamps are media time for video files and
+    wall-clock time for cameras.
+    """
+    # Initialize rate limiter for 1 request every 15 seconds
+    rate_limiter = RateLimiter(interval_seconds=3)
+    
+    # Load models, unless a shared FER service does the inference
+    service = None
+    if fer_service:
+        from fer_service import FERServiceClient
+        host, port = fer_service.rsplit(':', 1)
+        service = FERServiceClient((host, int(port)))
+        pth_backbone_model, pth_LSTM_model = None, None
+    else:
+        pth_backbone_model, pth_LSTM_model = load_fer_models()
+
+    sink = JsonlSink(jsonl) if jsonl else None
+    is_camera = isinstance(source, int) or str(source).isdigit()
+    verbose = jsonl != '-'  # keep stdout clean when it carries the JSONL stream
+
+    reuse = FeatureReuse(threshold=skip_threshold)
+    cap = open_capture(source)
+
+    # release everything on any exit, so buffered JSONL records survive an error or Ctrl-C
+    try:
+        async with aiohttp.ClientSession() as session:
+            last_ser_prediction = {'prediction': {'name': 'temp'}}
+            frame_index = 0
+
+            with mp.solutions.face_mesh.FaceMesh(min_detection_confidence=0.5) as face_mesh:
+                pipeline = FERPipeline(pth_backbone_model, pth_LSTM_model, face_mesh,
+                                       reuse=reuse, service=service)
+                while cap.isOpened():
+                    t1 = time.time()
+                    with tracing.span('capture'):
+                        success, frame = cap.read()
+                    if frame is None:
+                        break
+
+                    detections = pipeline.process(frame)
+                    if not headless:
+                        frame = pipeline.render(frame, detections)
+
+                    for _ in detections:
                         # Get SER prediction with rate limiting
                         ser_prediction, wait_time = await get_ser_prediction(session, rate_limiter)
                         if ser_prediction:
                             if ser_prediction['prediction'] is not None:
-                                print(ser_prediction['prediction']['name'], last_ser_prediction['prediction']['name'])
+                                if verbose:
+                                    print(ser_prediction['prediction']['name'], last_ser_prediction['prediction']['name'])
                                 if last_ser_prediction['prediction']['name'] != ser_prediction['prediction']['name']:
                                     last_ser_prediction = ser_prediction
-                                    print(f"Speech Emotion: {last_ser_prediction['prediction']['prob']}")
-                    
+                                    if verbose:
+                                        print(f"Speech Emotion: {last_ser_prediction['prediction']['prob']}")
+                
                         # Display the last known SER prediction and waiting time
                         y_position = 30  # Starting y position for text
                         # Display waiting time if rate limited
-                        if wait_time is not None and wait_time > 0:
+                        if not headless and wait_time is not None and wait_time > 0:
                             wait_text = f"Next prediction in: {wait_time:.1f}s"
                             cv2.putText(frame, wait_text, (10, y_position), cv2.FONT_HERSHEY_SIMPLEX,
                                       1, (255, 165, 0), 2, cv2.LINE_AA)
 
-                t2 = time.time()
-                frame = display_FPS(frame, 'FPS: {0:.1f}'.format(1 / (t2 - t1)), box_scale=.5)
-
-                cv2.imshow('Webcam', frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-
+                    if sink is not None and detections:
+                        ts = t1 if is_camera else cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                        for record in face_records(frame_index, ts, detections, ser_label(last_ser_prediction)):
+                            sink.write(record)
+                    frame_index += 1
+                    if headless:
+                        continue
+
+                    t2 = time.time()
+                    frame = display_FPS(frame, 'FPS: {0:.1f}'.format(1 / (t2 - t1)), box_scale=.5)
+
+                    with tracing.span('imshow'):
+                        cv2.imshow('Webcam', frame)
+                        key = cv2.waitKey(1)
+                    if key & 0xFF == ord('q'):
+                        break
+    finally:
         cap.release()
-        cv2.destroyAllWindows()
+        stats = reuse.stats()
+        if stats['threshold'] > 0:
+            print(f"backbone skipped on {stats['skipped']}/{stats['frames']} faces ({stats['skip_rate']:.1%})",
+                  file=sys.stderr)
+        if not headless:
+            cv2.destroyAllWindows()
+        if service is not None:
+            service.close()
+        if sink is not None:
+            sink.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', default='1', help='camera index, video file or directory of frames')
+    parser.add_argument('--skip-threshold', type=float, default=0.0,
+                        help='reuse backbone features while the face crop changes less than this (0-255 MAD); '
+                             'not available with --fer-service')
+    parser.add_argument('--fer-service', help='host:port of a running fer_service.py instead of local models')
+    parser.add_argument('--headless', action='store_true', help='no drawing, windows or waitKey')
+    parser.add_argument('--jsonl', help='stream per-face records to a file, - (stdout) or tcp://host:port')
+    args = parser.parse_args()
+    if args.fer_service and args.skip_threshold > 0:
+        parser.error('--skip-threshold has no effect with --fer-service: the service always runs the backbone')
+    asyncio.run(main(args.source, skip_threshold=args.skip_threshold, fer_service=args.fer_service,
+                     headless=args.headless, jsonl=args.jsonl))
 
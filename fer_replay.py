@@ -0,0 +1,151 @@
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+
+import cv2
+import mediapipe as mp
+import numpy as np
+import torch
+
+from cv_client import DICT_EMO, FERPipeline, FeatureReuse, display_FPS, load_fer_models, open_capture
+
+
+class StageTimer:
+    """Collects wall-clock durations per named stage."""
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - t0)
+
+    def summary(self):
+        report = {}
+        for name, durations in self.samples.items():
+            ms = np.asarray(durations) * 1000
+            report[name] = {
+                'count': len(ms),
+                'mean_ms': float(ms.mean()),
+                'p50_ms': float(np.percentile(ms, 50)),
+                'p95_ms': float(np.percentile(ms, 95)),
+                'total_s': float(ms.sum() / 1000),
+            }
+        return report
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def replay(source, output_dir=None, display=False, max_frames=None, skip_threshold=0.0, verify_skip=False):
+    """Run the FER pipeline over a video file or frame directory and return a benchmark report.
+
+    With `output_dir`, annotated frames go to `output_dir/frames/` and per-frame predictions
+    to `output_dir/predictions.jsonl`; the report is written to `output_dir/report.json`.
+    `skip_threshold` and `verify_skip` configure backbone feature reuse (see FeatureReuse).
+    """
+    timer = StageTimer()
+    reuse = FeatureReuse(threshold=skip_threshold, verify=verify_skip)
+    backbone_model, lstm_model = load_fer_models()
+    cap = open_capture(source)
+
+    predictions_file = None
+    if output_dir is not None:
+        os.makedirs(os.path.join(output_dir, 'frames'), exist_ok=True)
+        predictions_file = open(os.path.join(output_dir, 'predictions.jsonl'), 'w')
+
+    n_frames = n_faces = 0
+    t_start = time.perf_counter()
+    with mp.solutions.face_mesh.FaceMesh(min_detection_confidence=0.5) as face_mesh:
+        pipeline = FERPipeline(backbone_model, lstm_model, face_mesh, timer=timer, reuse=reuse)
+        while cap.isOpened() and (max_frames is None or n_frames < max_frames):
+            t1 = time.perf_counter()
+            success, frame = cap.read()
+            if frame is None:
+                break
+
+            detections = pipeline.process(frame)
+            frame = pipeline.render(frame, detections)
+            timer.samples['frame'].append(time.perf_counter() - t1)
+
+            if display or output_dir is not None:
+                frame = display_FPS(frame, 'FPS: {0:.1f}'.format(1 / (time.perf_counter() - t1)), box_scale=.5)
+            if output_dir is not None:
+                cv2.imwrite(os.path.join(output_dir, 'frames', f'{n_frames:06d}.jpg'), frame)
+                for box, output in detections:
+                    predictions_file.write(json.dumps({
+                        'frame': n_frames,
+                        'box': [int(v) for v in box],
+                        'label': DICT_EMO[int(np.argmax(output))],
+                        'prob': [round(float(p), 6) for p in output[0]],
+                    }) + '\n')
+            if display:
+                cv2.imshow('Replay', frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+
+            n_frames += 1
+            n_faces += len(detections)
+    elapsed = time.perf_counter() - t_start
+
+    cap.release()
+    if predictions_file is not None:
+        predictions_file.close()
+    if display:
+        cv2.destroyAllWindows()
+
+    report = {
+        'source': str(source),
+        'frames': n_frames,
+        'faces': n_faces,
+        'elapsed_s': elapsed,
+        'fps': n_frames / elapsed if elapsed > 0 else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'torch_threads': torch.get_num_threads(),
+        'stages': timer.summary(),
+        'feature_reuse': reuse.stats(),
+    }
+    if output_dir is not None:
+        with open(os.path.join(output_dir, 'report.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a video file or frame directory through the FER pipeline')
+    parser.add_argument('source', help='video file or directory of frames')
+    parser.add_argument('--output-dir', help='write annotated frames, predictions.jsonl and report.json here')
+    parser.add_argument('--display', action='store_true', help='show frames with cv2.imshow')
+    parser.add_argument('--max-frames', type=int)
+    parser.add_argument('--skip-threshold', type=float, default=0.0,
+                        help='reuse backbone features while the face crop changes less than this (0-255 MAD)')
+    parser.add_argument('--verify-skip', action='store_true',
+                        help='also run the backbone and LSTM without reuse to measure emitted-label agreement')
+    parser.add_argument('--threads', type=int, help='torch intra-op threads, fixed for comparable runs')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    report = replay(args.source, output_dir=args.output_dir, display=args.display, max_frames=args.max_frames,
+                    skip_threshold=args.skip_threshold, verify_skip=args.verify_skip)
+
+    print(f"{report['frames']} frames, {report['faces']} faces, {report['fps']:.1f} FPS, "
+          f"peak RSS {report['peak_rss_mb']:.0f} MiB")
+    for name, stats in report['stages'].items():
+        print(f"  {name:15s} n={stats['count']:5d} mean {stats['mean_ms']:7.2f} ms  "
+              f"p50 {stats['p50_ms']:7.2f} ms  p95 {stats['p95_ms']:7.2f} ms")
+    reuse = report['feature_reuse']
+    if reuse['threshold'] > 0:
+        agreement = 'n/a' if reuse['agreement'] is None else f"{reuse['agreement']:.1%}"
+        print(f"backbone skipped on {reuse['skip_rate']:.1%} of faces, label agreement {agreement}")
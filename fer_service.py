@@ -0,0 +1,255 @@
+import argparse
+import threading
+import time
+from collections import deque
+from multiprocessing import Process, Value, resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import torch
+from PIL import Image
+
+import tracing
+
+SERVICE_ADDRESS = ('127.0.0.1', 6010)
+AUTHKEY = b'pookie-fer'
+CROP_SIZE = 224
+N_EMO = 7
+LSTM_WINDOW = 10
+# slot states, stored in the shared header
+EMPTY, READY, DONE = 0, 1, 2
+BGR_MEAN = torch.tensor([91.4953, 103.8827, 131.0912]).view(1, 3, 1, 1)
+
+
+class SlotRing:
+    """Fixed set of request slots living in one shared-memory block.
+
+    Layout: int64 header [n_slots, 2] (state, face_id) | uint8 crops [n_slots, 224, 224, 3] (RGB)
+    | float32 outputs [n_slots, 7]. A client owns EMPTY slots and fills them, marks them READY;
+    the service writes the LSTM output and marks them DONE; the client reads and frees them.
+    """
+
+    def __init__(self, n_slots, name=None):
+        header_bytes = n_slots * 2 * 8
+        crop_bytes = n_slots * CROP_SIZE * CROP_SIZE * 3
+        size = header_bytes + crop_bytes + n_slots * N_EMO * 4
+        self.shm = SharedMemory(name=name, create=name is None, size=size)
+        self.owner = name is None
+        if not self.owner:
+            # attaching registers the block with this process's resource tracker, which
+            # would unlink it on exit (bpo-39959); the service owns its lifetime
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        buf = self.shm.buf
+        self.header = np.ndarray((n_slots, 2), dtype=np.int64, buffer=buf)
+        self.crops = np.ndarray((n_slots, CROP_SIZE, CROP_SIZE, 3), dtype=np.uint8, buffer=buf, offset=header_bytes)
+        self.outputs = np.ndarray((n_slots, N_EMO), dtype=np.float32, buffer=buf, offset=header_bytes + crop_bytes)
+        if self.owner:
+            self.header[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        del self.header, self.crops, self.outputs
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def crop_to_slot(face_rgb):
+    """Resize a face crop the same way as `pth_processing` (PIL nearest) to 224x224 RGB uint8."""
+    return np.asarray(Image.fromarray(face_rgb).resize((CROP_SIZE, CROP_SIZE), Image.Resampling.NEAREST))
+
+
+class FERService:
+    """Loads the FER backbone and LSTM once and serves face crops from many camera processes.
+
+    Each registered client gets its own SlotRing. One inference thread gathers READY slots
+    from every ring, runs the backbone on all of them in one batch, appends the features
+    to per-(client, face) histories and runs the LSTM on all histories in one batch.
+    """
+
+    def __init__(self, backbone_model, lstm_model, address=SERVICE_ADDRESS, max_batch=32):
+        self.backbone_model = backbone_model
+        self.lstm_model = lstm_model
+        self.address = address
+        self.max_batch = max_batch
+        self.clients = {}
+        self.histories = {}
+        self.lock = threading.Lock()
+        self.stop_flag = False
+        self.frames = 0
+        self.batches = 0
+
+    def serve_forever(self):
+        threading.Thread(target=self.inference_loop, daemon=True).start()
+        with Listener(self.address, authkey=AUTHKEY) as listener:
+            next_id = 0
+            while not self.stop_flag:
+                conn = listener.accept()
+                threading.Thread(target=self.handle_client, args=(conn, next_id), daemon=True).start()
+                next_id += 1
+
+    def handle_client(self, conn, client_id):
+        request = conn.recv()
+        ring = SlotRing(request.get('slots', 8))
+        with self.lock:
+            self.clients[client_id] = ring
+        conn.send({'client_id': client_id, 'shm': ring.name, 'slots': len(ring.header)})
+        try:
+            conn.recv()  # blocks until the client disconnects
+        except (EOFError, OSError):
+            pass
+        finally:
+            # under the lock so the inference thread is never mid-batch on this ring
+            with self.lock:
+                del self.clients[client_id]
+                for key in [k for k in self.histories if k[0] == client_id]:
+                    del self.histories[key]
+                ring.close()
+            conn.close()
+
+    def collect(self):
+        batch = []
+        for client_id, ring in self.clients.items():
+            for slot in np.flatnonzero(ring.header[:, 0] == READY):
+                batch.append((client_id, ring, int(slot)))
+                if len(batch) == self.max_batch:
+                    return batch
+        return batch
+
+    def step(self):
+        with self.lock, torch.no_grad():
+            return self._step()
+
+    def _step(self):
+        batch = self.collect()
+        if not batch:
+            return 0
+        with tracing.span('fer_service_batch', size=len(batch)):
+            crops = np.stack([ring.crops[slot] for _, ring, slot in batch])
+            x = torch.from_numpy(crops).permute(0, 3, 1, 2).to(torch.float32).flip(1) - BGR_MEAN
+            features = torch.nn.functional.relu(self.backbone_model.extract_features(x))
+
+            sequences = []
+            for (client_id, ring, slot), feature in zip(batch, features):
+                key = (client_id, int(ring.header[slot, 1]))
+                history = self.histories.get(key)
+                if history is None:
+                    history = self.histories[key] = deque([feature] * LSTM_WINDOW, maxlen=LSTM_WINDOW)
+                else:
+                    history.append(feature)
+                sequences.append(torch.stack(list(history)))
+            outputs = self.lstm_model(torch.stack(sequences)).numpy()
+
+        for (_, ring, slot), output in zip(batch, outputs):
+            ring.outputs[slot] = output
+            ring.header[slot, 0] = DONE
+        self.frames += len(batch)
+        self.batches += 1
+        return len(batch)
+
+    def inference_loop(self):
+        while not self.stop_flag:
+            if self.step() == 0:
+                time.sleep(0.0005)
+
+
+class FERServiceClient:
+    """Camera-side handle: writes crops into shared memory and waits for LSTM outputs."""
+
+    def __init__(self, address=SERVICE_ADDRESS, slots=8):
+        self.conn = Client(address, authkey=AUTHKEY)
+        self.conn.send({'slots': slots})
+        info = self.conn.recv()
+        self.client_id = info['client_id']
+        self.ring = SlotRing(info['slots'], name=info['shm'])
+
+    def infer(self, faces, timeout=5.0):
+        """Run [(face_id, rgb_crop), ...] through the service; returns one (1, 7) output per face."""
+        self.reclaim()
+        slots = []
+        for face_id, crop in faces:
+            free = np.flatnonzero(self.ring.header[:, 0] == EMPTY)
+            if len(free) == 0:
+                raise RuntimeError('No free FER service slot; raise `slots`')
+            slot = int(free[0])
+            self.ring.crops[slot] = crop if crop.shape[:2] == (CROP_SIZE, CROP_SIZE) else crop_to_slot(crop)
+            self.ring.header[slot, 1] = face_id
+            self.ring.header[slot, 0] = READY
+            slots.append(slot)
+
+        deadline = time.monotonic() + timeout
+        outputs = []
+        for slot in slots:
+            while self.ring.header[slot, 0] != DONE:
+                if time.monotonic() > deadline:
+                    # slots still READY are freed by a later `reclaim` once the service answers
+                    self.reclaim()
+                    raise TimeoutError('FER service did not answer in time')
+                time.sleep(0.0002)
+            outputs.append(self.ring.outputs[slot].copy()[None, :])
+            self.ring.header[slot, 0] = EMPTY
+        return outputs
+
+    def reclaim(self):
+        """Free DONE slots left behind by an `infer` call that timed out."""
+        done = self.ring.header[:, 0] == DONE
+        self.ring.header[done, 0] = EMPTY
+
+    def close(self):
+        self.ring.close()
+        self.conn.close()
+
+
+def _bench_client(address, seconds, frames_done, seed):
+    client = FERServiceClient(address)
+    crop = np.random.default_rng(seed).integers(0, 256, (CROP_SIZE, CROP_SIZE, 3), dtype=np.uint8)
+    t_end = time.monotonic() + seconds
+    n = 0
+    while time.monotonic() < t_end:
+        client.infer([(0, crop)])
+        n += 1
+    with frames_done.get_lock():
+        frames_done.value += n
+    client.close()
+
+
+def benchmark(n_clients, seconds=10.0, address=SERVICE_ADDRESS):
+    """Spawn `n_clients` camera processes sending one face per frame as fast as possible."""
+    frames_done = Value('q', 0)
+    procs = [Process(target=_bench_client, args=(address, seconds, frames_done, i)) for i in range(n_clients)]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - t0
+    return frames_done.value / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batched FER inference service over shared memory')
+    parser.add_argument('command', choices=['serve', 'bench'])
+    parser.add_argument('--port', type=int, default=SERVICE_ADDRESS[1])
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    from cv_client import load_fer_models
+
+    address = (SERVICE_ADDRESS[0], args.port)
+    service = FERService(*load_fer_models(), address=address, max_batch=args.max_batch)
+    if args.command == 'serve':
+        service.serve_forever()
+    else:
+        threading.Thread(target=service.serve_forever, daemon=True).start()
+        time.sleep(1.0)
+        for n in args.clients:
+            frames, batches = service.frames, service.batches
+            fps = benchmark(n, seconds=args.seconds, address=address)
+            mean_batch = (service.frames - frames) / max(1, service.batches - batches)
+            print(f'{n:3d} clients: {fps:7.1f} frames/s total, {fps / n:6.1f} per client, mean batch {mean_batch:.1f}')
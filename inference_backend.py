@@ -0,0 +1,239 @@
+import argparse
+import copy
+import gc
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import psutil
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from vistec_ser.data.datasets.thaiser import ThaiSERDataModule
+from vistec_ser.inference.inference import setup_server
+from vistec_ser.utils.utils import read_config, load_yaml
+
+from audio_io import extract_feature
+
+
+def quantized_path(onnx_path: str) -> str:
+    """Path of the int8 variant written next to `onnx_path`."""
+    root, ext = os.path.splitext(onnx_path)
+    return f"{root}.int8{ext}"
+
+
+class OnnxModel:
+    """Callable stand-in for CNN1DLSTMSlice backed by an ONNX Runtime CPU session.
+
+    Takes and returns torch tensors so it can be passed to `infer_sample` unchanged.
+    """
+
+    def __init__(self, onnx_path: str, intra_op_threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def run(self, feature: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(feature, dtype=np.float32)})[0]
+
+    def __call__(self, feature: torch.Tensor) -> torch.Tensor:
+        return torch.from_numpy(self.run(feature.numpy()))
+
+    def eval(self):
+        return self
+
+
+class InferenceModeModel:
+    """Runs the wrapped module under `torch.inference_mode`; `infer_sample` itself does not disable autograd."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, feature: torch.Tensor) -> torch.Tensor:
+        with torch.inference_mode():
+            return self.model(feature)
+
+    def eval(self):
+        return self
+
+
+def set_threads(intra_op_threads: int = 0, inter_op_threads: int = 0) -> None:
+    """Pin torch's thread pools; 0 keeps torch's default for that pool."""
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # can only be set once, before any inter-op parallel work has started
+            print(f"inter_op_threads={inter_op_threads} ignored: torch inter-op pool already started")
+
+
+def optimize_for_cpu(model: nn.Module, quantize: bool = False) -> InferenceModeModel:
+    """Dynamic int8 quantization of the LSTM and Linear layers (weights int8, activations float)."""
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+    return InferenceModeModel(model.eval())
+
+
+def setup_inference(config_path: str):
+    """Like `setup_server`, but honours `inference.backend` (torch | onnx) and the CPU profile.
+
+    `quantize_dynamic`, `intra_op_threads` and `inter_op_threads` from the `inference`
+    section apply to the torch backend; `intra_op_threads` also sizes the ONNX session.
+    """
+    config = load_yaml(config_path)
+    inference_config = config.get("inference", {})
+    backend = inference_config.get("backend", "torch")
+    intra_op_threads = inference_config.get("intra_op_threads", 0)
+    set_threads(intra_op_threads, inference_config.get("inter_op_threads", 0))
+    if backend == "torch":
+        model, thaiser_module, temp_dir = setup_server(config_path)
+        quantize = inference_config.get("quantize_dynamic", False)
+        return optimize_for_cpu(model, quantize=quantize), thaiser_module, temp_dir
+    if backend != "onnx":
+        raise ValueError(f"Unknown inference backend `{backend}`")
+
+    temp_dir = inference_config.get("temp_dir", "./inference_temp")
+    if not os.path.exists(temp_dir):
+        os.makedirs(temp_dir)
+
+    onnx_path = inference_config["onnx_path"]
+    if inference_config.get("onnx_quantize", False):
+        onnx_path = quantized_path(onnx_path)
+    if not os.path.exists(onnx_path):
+        raise FileNotFoundError(f"ONNX model `{onnx_path}` not found. Run `python inference_backend.py export`.")
+
+    _, module_params = read_config(config)
+    thaiser_module = ThaiSERDataModule(**module_params)
+    model = OnnxModel(onnx_path, intra_op_threads=intra_op_threads)
+    return model, thaiser_module, temp_dir
+
+
+def dummy_input(thaiser_module, batch_size: int = 1) -> torch.Tensor:
+    # CNN1DLSTMSlice normalizes over [channels, time] with a fixed sequence_length,
+    # so only the batch axis can be dynamic; longer clips are chopped into max_len chunks.
+    return torch.randn(batch_size, thaiser_module.num_mel_bins, thaiser_module.max_len * 100)
+
+
+def export_onnx(config_path: str, quantize: bool = False) -> None:
+    """Export the configured checkpoint to `inference.onnx_path` and check parity against torch."""
+    config = load_yaml(config_path)
+    onnx_path = config["inference"]["onnx_path"]
+    model, thaiser_module, _ = setup_server(config_path)
+
+    torch.onnx.export(
+        model, dummy_input(thaiser_module), onnx_path,
+        input_names=["feature"], output_names=["logits"],
+        dynamic_axes={"feature": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17
+    )
+    print(f"Exported {onnx_path}")
+    paths = [onnx_path]
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(onnx_path, quantized_path(onnx_path), weight_type=QuantType.QInt8)
+        print(f"Exported {quantized_path(onnx_path)}")
+        paths.append(quantized_path(onnx_path))
+
+    x = dummy_input(thaiser_module, batch_size=8)
+    with torch.no_grad():
+        expected = model(x).numpy()
+    for path in paths:
+        actual = OnnxModel(path).run(x.numpy())
+        agreement = (actual.argmax(-1) == expected.argmax(-1)).mean()
+        print(f"{os.path.basename(path)}: max |logit diff| = {np.abs(actual - expected).max():.2e}, "
+              f"argmax agreement = {agreement:.0%}")
+    np.testing.assert_allclose(OnnxModel(onnx_path).run(x.numpy()), expected, rtol=1e-3, atol=1e-4)
+
+
+def compare(config_path: str, batch_size: int = 1, n_iter: int = 100) -> None:
+    """Print per-batch latency and resident memory growth for each available backend."""
+    config = load_yaml(config_path)
+    onnx_path = config["inference"]["onnx_path"]
+    process = psutil.Process()
+
+    rss = process.memory_info().rss
+    model, thaiser_module, _ = setup_server(config_path)
+    candidates = [("torch", model, process.memory_info().rss - rss)]
+    # quantize a second, freshly loaded model and drop its float32 weights before reading
+    # RSS, so the row compares with "torch" instead of including a float copy
+    rss = process.memory_info().rss
+    float_model, _, _ = setup_server(config_path)
+    quantized = optimize_for_cpu(float_model, quantize=True)
+    del float_model
+    gc.collect()
+    candidates.append(("torch-int8", quantized, process.memory_info().rss - rss))
+    for name, path in [("onnx", onnx_path), ("onnx-int8", quantized_path(onnx_path))]:
+        if os.path.exists(path):
+            rss = process.memory_info().rss
+            candidates.append((name, OnnxModel(path), process.memory_info().rss - rss))
+
+    x = dummy_input(thaiser_module, batch_size)
+    for name, backend, mem in candidates:
+        with torch.no_grad():
+            backend(x)
+            t0 = time.perf_counter()
+            for _ in range(n_iter):
+                backend(x)
+        latency = (time.perf_counter() - t0) / n_iter
+        print(f"{name:10s} batch={batch_size} {latency * 1000:7.2f} ms/batch  +{mem / 2**20:.1f} MiB RSS on load")
+
+
+def evaluate(config_path: str, csv_path: str) -> None:
+    """Accuracy of the float32 and dynamic-int8 torch models on a held-out CSV (PATH, EMOTION columns)."""
+    model, thaiser_module, _ = setup_server(config_path)
+    emotions = thaiser_module.emotions
+    backends = {"float32": optimize_for_cpu(model),
+                "int8": optimize_for_cpu(copy.deepcopy(model), quantize=True)}
+
+    heldout = pd.read_csv(csv_path)
+    heldout = heldout[heldout["EMOTION"].str.lower().str.strip().isin(emotions)]
+    labels = [emotions.index(e.lower().strip()) for e in heldout["EMOTION"]]
+    samples = list(extract_feature(thaiser_module, list(heldout["PATH"])))
+
+    predictions, latency = {}, {}
+    for name, backend in backends.items():
+        t0 = time.perf_counter()
+        predictions[name] = np.array([
+            int(F.softmax(torch.stack([backend(chunk["feature"]) for chunk in sample]).mean(dim=0)[0], dim=-1).argmax())
+            for sample in samples])
+        latency[name] = (time.perf_counter() - t0) / max(1, len(samples))
+
+    labels = np.array(labels)
+    print(f"{len(labels)} held-out clips, threads={torch.get_num_threads()}")
+    for name in backends:
+        accuracy = (predictions[name] == labels).mean()
+        print(f"{name:8s} accuracy {accuracy:.2%}  {latency[name] * 1000:7.2f} ms/clip")
+    delta = (predictions["int8"] == labels).mean() - (predictions["float32"] == labels).mean()
+    agreement = (predictions["int8"] == predictions["float32"]).mean()
+    print(f"int8 - float32 accuracy delta {delta:+.2%}, prediction agreement {agreement:.2%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and benchmark SER inference backends")
+    parser.add_argument("command", choices=["export", "compare", "evaluate"])
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--quantize", action="store_true", help="also write an int8 dynamic-quantized model")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--heldout", help="evaluate: CSV with PATH and EMOTION columns")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.command == "evaluate" and not args.heldout:
+        parser.error("evaluate requires --heldout")
+    set_threads(args.threads)
+
+    if args.command == "export":
+        export_onnx(args.config, quantize=args.quantize)
+    elif args.command == "compare":
+        compare(args.config, batch_size=args.batch_size)
+    else:
+        evaluate(args.config, args.heldout)
@@ -0,0 +1,117 @@
+from typing import Dict, Iterator, List, Tuple
+import os
+
+import soundfile as sf
+import torch
+import torch.nn.functional as F
+
+from vistec_ser.data.features.padding import pad_dup
+from vistec_ser.data.features.transform import FilterBank, NormalizeSample
+
+from audio_io import to_mono
+import tracing
+
+
+def window_samples(thaiser_module) -> int:
+    """Number of samples at the target rate that yield exactly `max_len` seconds of fbank frames."""
+    n_frames = thaiser_module.max_len * 100
+    frame_length = thaiser_module.sampling_rate * thaiser_module.frame_length // 1000
+    frame_shift = thaiser_module.sampling_rate * thaiser_module.frame_shift // 1000
+    return frame_length + (n_frames - 1) * frame_shift
+
+
+def iter_windows(audio_path: str, thaiser_module, hop: float, min_len: float = 0.5
+                 ) -> Iterator[Tuple[float, float, torch.Tensor]]:
+    """Lazily read overlapping mono windows of `audio_path` as (start_s, end_s, (1, n_samples) tensor).
+
+    Only one window is held in memory at a time. A trailing window shorter than
+    `min_len` seconds is dropped unless it is the whole file.
+    """
+    target_rate = thaiser_module.sampling_rate
+    with sf.SoundFile(audio_path) as f:
+        orig_rate = f.samplerate
+        window = round(window_samples(thaiser_module) * orig_rate / target_rate)
+        step = max(1, round(hop * orig_rate))
+        start = 0
+        while start < f.frames:
+            f.seek(start)
+            block = f.read(window, dtype="float32", always_2d=True)
+            if start > 0 and len(block) < min_len * orig_rate:
+                break
+            audio = torch.from_numpy(to_mono(block, orig_rate, target_rate)).unsqueeze(0)
+            yield start / orig_rate, (start + len(block)) / orig_rate, audio
+            if start + window >= f.frames:
+                break
+            start += step
+
+
+class WindowFeaturizer:
+    """Turn a raw window into a normalized (num_mel_bins, max_len * 100) fbank tensor."""
+
+    def __init__(self, thaiser_module):
+        self.n_frames = thaiser_module.max_len * 100
+        self.filterbank = FilterBank(
+            frame_length=thaiser_module.frame_length,
+            frame_shift=thaiser_module.frame_shift,
+            num_mel_bins=thaiser_module.num_mel_bins,
+            sample_frequency=thaiser_module.sampling_rate
+        )
+        self.normalize = NormalizeSample(thaiser_module.center_feats, thaiser_module.scale_feats)
+
+    def __call__(self, audio: torch.Tensor) -> torch.Tensor:
+        feature = self.filterbank({"feature": audio, "emotion": None})["feature"]
+        if feature.shape[-1] < self.n_frames:
+            feature = pad_dup(feature, max_len=self.n_frames)
+        feature = feature[:, :self.n_frames]
+        return self.normalize({"feature": feature, "emotion": None})["feature"]
+
+
+def format_prob(prob: torch.Tensor, emotions: List[str]) -> Dict[str, str]:
+    return {emotion: f"{p * 100:.2f}" for emotion, p in zip(emotions, prob.tolist())}
+
+
+def iter_segment_predictions(model, thaiser_module, audio_path: str, hop: float = None,
+                             batch_size: int = 16) -> Iterator[Dict]:
+    """Yield one record per window, then a final clip-level record with `"segments"` set to the window count.
+
+    Windows are featurized and run through `model` `batch_size` at a time. The clip-level
+    distribution is the softmax of the mean window logits, matching `infer_sample`.
+    """
+    emotions = thaiser_module.emotions
+    hop = hop or thaiser_module.max_len / 2
+    featurize = WindowFeaturizer(thaiser_module)
+    name = os.path.basename(audio_path)
+    logit_sum, n_windows = None, 0
+
+    def flush(spans, features):
+        nonlocal logit_sum, n_windows
+        with tracing.span("window_batch", size=len(features)), torch.no_grad():
+            logits = model(torch.stack(features))
+        batch_sum = logits.sum(dim=0)
+        logit_sum = batch_sum if logit_sum is None else logit_sum + batch_sum
+        n_windows += len(features)
+        for (start, end), prob in zip(spans, F.softmax(logits, dim=-1)):
+            yield {"name": name, "start": round(start, 3), "end": round(end, 3),
+                   "prob": format_prob(prob, emotions)}
+
+    spans, features = [], []
+    for start, end, audio in iter_windows(audio_path, thaiser_module, hop):
+        spans.append((start, end))
+        features.append(featurize(audio))
+        if len(features) == batch_size:
+            yield from flush(spans, features)
+            spans, features = [], []
+    if features:
+        yield from flush(spans, features)
+
+    if n_windows == 0:
+        raise ValueError(f"`{audio_path}` contains no audio")
+    yield {"name": name, "prob": format_prob(F.softmax(logit_sum / n_windows, dim=-1), emotions),
+           "segments": n_windows}
+
+
+def predict_long_audio(model, thaiser_module, audio_path: str, hop: float = None, batch_size: int = 16) -> Dict:
+    """Clip-level prediction for an arbitrarily long file, in the same shape as `infer_sample`."""
+    for record in iter_segment_predictions(model, thaiser_module, audio_path, hop=hop, batch_size=batch_size):
+        pass
+    return {"name": record["name"], "prob": record["prob"]}
@@ -0,0 +1,253 @@
+from typing import Callable, Dict, List, Optional
+import argparse
+import threading
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from long_audio import WindowFeaturizer, format_prob, window_samples
+import tracing
+
+
+def pcm16_to_float(data: bytes) -> np.ndarray:
+    """Little-endian int16 mono PCM bytes -> float32 samples in [-1, 1]."""
+    return np.frombuffer(data, dtype="<i2", count=len(data) // 2).astype(np.float32) / 32768.0
+
+
+class SessionStream:
+    """Per-session ring buffer of mono PCM at the model's sampling rate.
+
+    Sample positions are absolute (`total` counts every sample ever pushed). If the
+    scheduler falls more than one buffer behind, the oldest windows are skipped so the
+    session always catches up to recent audio.
+    """
+
+    def __init__(self, window: int, hop: int, capacity: int):
+        self.window = window
+        self.hop = hop
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.total = 0
+        self.next_start = 0
+        self.lock = threading.Lock()
+        self.last_push = time.monotonic()
+        self.windows = 0
+        self.dropped_windows = 0
+        self.latest = None
+
+    def push(self, pcm: np.ndarray) -> None:
+        capacity = len(self.buffer)
+        with self.lock:
+            if len(pcm) > capacity:
+                self.total += len(pcm) - capacity
+                pcm = pcm[-capacity:]
+            idx = (self.total + np.arange(len(pcm))) % capacity
+            self.buffer[idx] = pcm
+            self.total += len(pcm)
+            self.last_push = time.monotonic()
+
+    def pop_window(self) -> Optional[tuple]:
+        """Return (start_sample, window samples) for the next ready window, or None."""
+        capacity = len(self.buffer)
+        with self.lock:
+            oldest = self.total - capacity
+            if self.next_start < oldest:
+                skipped = -(-(oldest - self.next_start) // self.hop)
+                self.next_start += skipped * self.hop
+                self.dropped_windows += skipped
+            if self.total - self.next_start < self.window:
+                return None
+            start = self.next_start
+            idx = (start + np.arange(self.window)) % capacity
+            audio = self.buffer[idx]
+            self.next_start += self.hop
+        return start, audio
+
+
+class SessionScheduler:
+    """One inference thread serving many audio sessions through a single loaded model.
+
+    Ready windows are collected round-robin across sessions (at most one per session
+    per round) into batches of up to `batch_size`, featurized and run as one forward pass.
+    Callbacks registered with `subscribe` receive the session state after every window,
+    on the scheduler thread.
+    """
+
+    def __init__(self, model, thaiser_module, hop: float = None, batch_size: int = 16,
+                 buffer_seconds: float = None, idle_timeout: float = 300.0):
+        self.model = model
+        self.thaiser_module = thaiser_module
+        self.sampling_rate = thaiser_module.sampling_rate
+        self.window = window_samples(thaiser_module)
+        self.hop = round((hop or thaiser_module.max_len / 2) * self.sampling_rate)
+        self.capacity = round((buffer_seconds or 4 * thaiser_module.max_len) * self.sampling_rate)
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.featurize = WindowFeaturizer(thaiser_module)
+        self.sessions: Dict[str, SessionStream] = {}
+        self.sessions_lock = threading.Lock()
+        self.subscribers: Dict[str, List[Callable[[Dict], None]]] = {}
+        self.wakeup = threading.Event()
+        self.stop_flag = False
+        self.batches = 0
+        self.windows = 0
+
+    def get_session(self, session_id: str) -> SessionStream:
+        with self.sessions_lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = SessionStream(self.window, self.hop, max(self.capacity, self.window + self.hop))
+                self.sessions[session_id] = session
+            return session
+
+    def push(self, session_id: str, pcm: np.ndarray) -> None:
+        self.get_session(session_id).push(pcm)
+        self.wakeup.set()
+
+    def remove(self, session_id: str) -> None:
+        with self.sessions_lock:
+            self.sessions.pop(session_id, None)
+
+    def subscribe(self, session_id: str, callback: Callable[[Dict], None]) -> None:
+        with self.sessions_lock:
+            self.subscribers.setdefault(session_id, []).append(callback)
+
+    def unsubscribe(self, session_id: str, callback: Callable[[Dict], None]) -> None:
+        with self.sessions_lock:
+            callbacks = self.subscribers.get(session_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self.subscribers.pop(session_id, None)
+
+    def state(self, session_id: str) -> Optional[Dict]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        return self._state(session_id, session)
+
+    def _state(self, session_id: str, session: SessionStream) -> Dict:
+        return {
+            "session": session_id,
+            "received_s": round(session.total / self.sampling_rate, 3),
+            "windows": session.windows,
+            "dropped_windows": session.dropped_windows,
+            "prediction": session.latest,
+        }
+
+    def _collect(self) -> List[tuple]:
+        with self.sessions_lock:
+            sessions = list(self.sessions.items())
+        batch = []
+        while len(batch) < self.batch_size:
+            progressed = False
+            for session_id, session in sessions:
+                if len(batch) == self.batch_size:
+                    break
+                ready = session.pop_window()
+                if ready is not None:
+                    batch.append((session_id, session, *ready))
+                    progressed = True
+            if not progressed:
+                break
+        return batch
+
+    def _expire_idle(self) -> None:
+        now = time.monotonic()
+        with self.sessions_lock:
+            for session_id in [s for s, session in self.sessions.items()
+                               if now - session.last_push > self.idle_timeout]:
+                del self.sessions[session_id]
+
+    def step(self) -> int:
+        """Run one batch if any window is ready; return the number of windows processed."""
+        batch = self._collect()
+        if not batch:
+            return 0
+        with tracing.span("session_batch", size=len(batch)):
+            features = torch.stack([self.featurize(torch.from_numpy(audio).unsqueeze(0))
+                                    for _, _, _, audio in batch])
+            with torch.no_grad():
+                probs = F.softmax(self.model(features), dim=-1)
+        for (session_id, session, start, _), prob in zip(batch, probs):
+            session.latest = {
+                "name": session_id,
+                "start": round(start / self.sampling_rate, 3),
+                "end": round((start + self.window) / self.sampling_rate, 3),
+                "prob": format_prob(prob, self.thaiser_module.emotions),
+            }
+            session.windows += 1
+            with self.sessions_lock:
+                callbacks = list(self.subscribers.get(session_id, ()))
+            for callback in callbacks:
+                callback(self._state(session_id, session))
+        self.batches += 1
+        self.windows += len(batch)
+        return len(batch)
+
+    def run(self) -> None:
+        last_expire = time.monotonic()
+        while not self.stop_flag:
+            if self.step() == 0:
+                self.wakeup.wait(timeout=0.1)
+                self.wakeup.clear()
+            if time.monotonic() - last_expire > 10:
+                self._expire_idle()
+                last_expire = time.monotonic()
+
+    def stop(self) -> None:
+        self.stop_flag = True
+        self.wakeup.set()
+
+
+def benchmark(config_path: str, n_sessions: int, seconds: float, chunk_ms: int = 100) -> Dict:
+    """Feed `n_sessions` synthetic real-time streams for `seconds` and report whether inference kept up."""
+    from inference_backend import setup_inference
+
+    model, thaiser_module, _ = setup_inference(config_path)
+    scheduler = SessionScheduler(model, thaiser_module)
+    worker = threading.Thread(target=scheduler.run, daemon=True)
+    worker.start()
+
+    rng = np.random.default_rng(0)
+    chunk = thaiser_module.sampling_rate * chunk_ms // 1000
+    cpu_start, t_start = time.process_time(), time.perf_counter()
+    while time.perf_counter() - t_start < seconds:
+        tick = time.perf_counter()
+        for i in range(n_sessions):
+            scheduler.push(f"session-{i}", rng.standard_normal(chunk).astype(np.float32) * 0.1)
+        time.sleep(max(0.0, chunk_ms / 1000 - (time.perf_counter() - tick)))
+    elapsed = time.perf_counter() - t_start
+    cpu = time.process_time() - cpu_start
+    scheduler.stop()
+    worker.join()
+
+    expected = sum(max(0, (s.total - scheduler.window) // scheduler.hop + 1) for s in scheduler.sessions.values())
+    dropped = sum(s.dropped_windows for s in scheduler.sessions.values())
+    return {
+        "sessions": n_sessions,
+        "windows": scheduler.windows,
+        "expected_windows": expected,
+        "dropped_windows": dropped,
+        "mean_batch": scheduler.windows / max(1, scheduler.batches),
+        "cores_used": cpu / elapsed,
+        "sessions_per_core": n_sessions / max(cpu / elapsed, 1e-9),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how many real-time SER sessions one process sustains")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    for n in args.sessions:
+        r = benchmark(args.config, n, args.seconds)
+        print(f"{r['sessions']:4d} sessions: {r['windows']}/{r['expected_windows']} windows "
+              f"({r['dropped_windows']} dropped), mean batch {r['mean_batch']:.1f}, "
+              f"{r['cores_used']:.2f} cores, {r['sessions_per_core']:.1f} sessions/core")
@@ -1,52 +1,120 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from contextlib import asynccontextmanager
 from typing import List
 import os
 import asyncio
 import subprocess
-from vistec_ser.inference.inference import infer_sample, setup_server
+from vistec_ser.inference.inference import infer_sample
+from inference_backend import setup_inference
+from vistec_ser.utils.utils import load_yaml
+from audio_io import extract_feature, ffmpeg_capture_args
+from long_audio import predict_long_audio
+from ser_sessions import SessionScheduler, pcm16_to_float
+import tracing
 from datetime import datetime
 import threading
-from queue import Queue
+from collections import deque
+from queue import Empty
 import time
 
 # Global objects that will be initialized in lifespan
 recorder = None
 predictor = None
-prediction_queue = Queue()  # Shared queue between recorder and predictor
+scheduler = None
+prediction_queue = None  # Shared queue between recorder and predictor
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Initialize global objects
-    global recorder, predictor
+    global recorder, predictor, scheduler, prediction_queue
     
     # Setup server components
     config_path = "config.yaml"
-    model, thaiser_module, temp_dir = setup_server(config_path)
+    model, thaiser_module, temp_dir = setup_inference(config_path)
+    inference_config = load_yaml(config_path)["inference"]
     
     # Initialize recorder and predictor
-    recorder = AudioRecorder(temp_dir, prediction_queue)
-    predictor = PredictionWorker(model, thaiser_module, prediction_queue)
+    max_lag = inference_config.get("max_prediction_lag", 10)
+    prediction_queue = LatestWinsQueue(maxsize=inference_config.get("queue_size", 1), on_drop=remove_file)
+    recorder = AudioRecorder(temp_dir, prediction_queue, thaiser_module.sampling_rate, max_age=max_lag)
+    predictor = PredictionWorker(model, thaiser_module, prediction_queue,
+                                 long_audio=inference_config.get("long_audio", False),
+                                 window_hop=inference_config.get("window_hop"),
+                                 window_batch_size=inference_config.get("window_batch_size", 16),
+                                 max_lag=max_lag)
+    # Shared scheduler for audio pushed by remote sessions (kiosks)
+    scheduler = SessionScheduler(model, thaiser_module,
+                                 hop=inference_config.get("window_hop"),
+                                 batch_size=inference_config.get("window_batch_size", 16),
+                                 idle_timeout=inference_config.get("session_idle_timeout", 300))
     
-    # Start recording thread
-    recording_thread = threading.Thread(target=recorder.start_recording_loop, daemon=True)
-    recording_thread.start()
-    
-    # Start prediction thread
-    prediction_thread = threading.Thread(target=predictor.prediction_loop, daemon=True)
-    prediction_thread.start()
+    if inference_config.get("local_microphone", True):
+        # Start recording thread
+        recording_thread = threading.Thread(target=recorder.start_recording_loop, daemon=True)
+        recording_thread.start()
+        
+        # Start prediction thread
+        prediction_thread = threading.Thread(target=predictor.prediction_loop, daemon=True)
+        prediction_thread.start()
+
+    # Start session scheduler thread
+    scheduler_thread = threading.Thread(target=scheduler.run, daemon=True)
+    scheduler_thread.start()
     
     yield  # Server is running
     
     # Cleanup
     recorder.stop()
     predictor.stop()
+    scheduler.stop()
 
 app = FastAPI(lifespan=lifespan)
 
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class LatestWinsQueue:
+    """Bounded handoff that keeps only the newest `maxsize` items.
+
+    `put` never blocks: when full, the oldest item is evicted, counted in `dropped`
+    and passed to `on_drop`. `get` returns (enqueued_at, item) with a monotonic timestamp.
+    """
+    def __init__(self, maxsize=1, on_drop=None):
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        evicted = []
+        with self.cond:
+            self.items.append((time.monotonic(), item))
+            while len(self.items) > self.maxsize:
+                evicted.append(self.items.popleft()[1])
+            self.dropped += len(evicted)
+            self.cond.notify()
+        if self.on_drop is not None:
+            for old in evicted:
+                self.on_drop(old)
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items, timeout=timeout):
+                raise Empty
+            return self.items.popleft()
+
+    def qsize(self):
+        return len(self.items)
+
 class AudioRecorder:
-    def __init__(self, temp_dir, queue):
+    def __init__(self, temp_dir, queue, sampling_rate=16000, max_age=10):
         self.temp_dir = temp_dir
+        self.sampling_rate = sampling_rate
+        self.max_age = max_age
         self.current_recording = None
         self.stop_flag = False
         self.prediction_queue = queue
@@ -63,65 +131,113 @@ class AudioRecorder:
                 "-f", "avfoundation",
                 "-i", ":0",
                 "-t", "5",
-                "-ar", "16000",
-                "-ac", "2",
+                *ffmpeg_capture_args(self.sampling_rate),
                 audio_filename
             ]
             
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            time.sleep(5)  # Wait for recording to complete
-            process.terminate()
+            with tracing.span("ffmpeg_record", file=audio_filename):
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                time.sleep(5)  # Wait for recording to complete
+                process.terminate()
             
             # Add to prediction queue
             self.prediction_queue.put(audio_filename)
+            tracing.instant("enqueue", file=audio_filename)
             
             # Clean up old recordings
             self._cleanup_old_files()
 
     def _cleanup_old_files(self):
-        # Keep only the last 5 recordings
-        files = sorted([f for f in os.listdir(self.temp_dir) if f.startswith("recorded_audio")])
-        for old_file in files[:-1]:
+        # Queued, dropped and processed clips are removed by their owner; this only
+        # sweeps leftovers (e.g. from a crash) that are well past the staleness deadline
+        deadline = time.time() - 2 * self.max_age
+        for old_file in os.listdir(self.temp_dir):
+            path = os.path.join(self.temp_dir, old_file)
             try:
-                os.remove(os.path.join(self.temp_dir, old_file))
-            except:
+                if old_file.startswith("recorded_audio") and os.path.getmtime(path) < deadline:
+                    os.remove(path)
+            except OSError:
                 pass
 
     def stop(self):
         self.stop_flag = True
 
 class PredictionWorker:
-    def __init__(self, model, thaiser_module, queue):
+    def __init__(self, model, thaiser_module, queue, long_audio=False, window_hop=None, window_batch_size=16,
+                 max_lag=10):
         self.model = model
         self.thaiser_module = thaiser_module
+        self.long_audio = long_audio
+        self.window_hop = window_hop
+        self.window_batch_size = window_batch_size
+        self.max_lag = max_lag
         self.stop_flag = False
         self.latest_prediction = None
+        self.latest_recorded_at = None
         self.prediction_queue = queue
+        self.processed = 0
+        self.stale = 0
+        self.errors = 0
+        self.last_error = None
 
     def prediction_loop(self):
         while not self.stop_flag:
             try:
                 # Get the next audio file from queue
-                audio_filename = self.prediction_queue.get(timeout=1)
-                print(self.prediction_queue)
+                enqueued_at, audio_filename = self.prediction_queue.get(timeout=1)
+            except Empty:
+                continue
+            tracing.instant("dequeue", file=audio_filename)
+
+            try:
+                # Drop clips that waited past the deadline instead of reporting stale results
+                if time.monotonic() - enqueued_at > self.max_lag:
+                    self.stale += 1
+                    continue
 
                 # Process the audio file
-                inference_loader = self.thaiser_module.extract_feature([audio_filename])
-                inference_results = [infer_sample(self.model, sample, emotions=self.thaiser_module.emotions)
-                                   for sample in inference_loader]
-                
+                if self.long_audio:
+                    with tracing.span("predict_long_audio", file=audio_filename):
+                        prediction = predict_long_audio(
+                            self.model, self.thaiser_module, audio_filename,
+                            hop=self.window_hop, batch_size=self.window_batch_size)
+                else:
+                    with tracing.span("extract_feature", file=audio_filename):
+                        inference_loader = extract_feature(self.thaiser_module, [audio_filename])
+                    with tracing.span("infer_sample"):
+                        inference_results = [infer_sample(self.model, sample, emotions=self.thaiser_module.emotions)
+                                           for sample in inference_loader]
+                    prediction = inference_results[0] if inference_results else None
+
                 # Store the latest prediction
-                self.latest_prediction = inference_results[0] if inference_results else None
+                self.latest_prediction = prediction
+                self.latest_recorded_at = enqueued_at
+                self.processed += 1
                 print(self.latest_prediction)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = repr(e)
+                print(f"Prediction failed for {audio_filename}: {e!r}")
+            finally:
                 # Clean up the processed file
-                try:
-                    os.remove(audio_filename)
-                except:
-                    pass
-                
-            except:
-                # No audio file in queue
-                pass
+                remove_file(audio_filename)
+
+    def prediction_age(self):
+        """Seconds since the end of the clip behind `latest_prediction`, or None."""
+        if self.latest_recorded_at is None:
+            return None
+        return time.monotonic() - self.latest_recorded_at
+
+    def stats(self):
+        return {
+            "queued": self.prediction_queue.qsize(),
+            "processed": self.processed,
+            "dropped_overflow": self.prediction_queue.dropped,
+            "dropped_stale": self.stale,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "prediction_age_s": self.prediction_age(),
+        }
 
     def stop(self):
         self.stop_flag = True
@@ -139,4 +255,79 @@ async def get_latest_prediction():
         return {"error": "Server not fully initialized"}
     
     prediction = predictor.get_latest_prediction()
-    return {"prediction": prediction if prediction is not None else None}
\ No newline at end of file
+    return {"prediction": prediction if prediction is not None else None,
+            "age_s": predictor.prediction_age()}
+
+@app.get("/stats")
+async def stats():
+    if predictor is None:
+        return {"error": "Server not fully initialized"}
+    return predictor.stats()
+
+# Session streams: clients push little-endian int16 mono PCM at feature.sampling_rate
+
+@app.post("/sessions/{session_id}/audio")
+async def push_session_audio(session_id: str, request: Request):
+    """Append audio to a session; the body may be sent with chunked transfer encoding."""
+    if scheduler is None:
+        raise HTTPException(status_code=503, detail="Server not fully initialized")
+    carry = b""
+    received = 0
+    async for chunk in request.stream():
+        data = carry + chunk
+        usable = len(data) - len(data) % 2
+        carry = data[usable:]
+        if usable:
+            scheduler.push(session_id, pcm16_to_float(data[:usable]))
+            received += usable
+    if received == 0:
+        raise HTTPException(status_code=400, detail="Empty body: expected int16 PCM samples")
+    return scheduler.state(session_id)
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    state = scheduler.state(session_id) if scheduler is not None else None
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"Unknown session `{session_id}`")
+    return state
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if scheduler is not None:
+        scheduler.remove(session_id)
+    return {"session": session_id, "deleted": True}
+
+@app.websocket("/sessions/{session_id}/ws")
+async def session_websocket(websocket: WebSocket, session_id: str):
+    """Receive binary PCM frames and send back every window prediction as JSON, as soon as it is ready."""
+    if scheduler is None:
+        await websocket.close(code=1013)  # try again later
+        return
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+    predictions = asyncio.Queue()
+
+    def notify(state):
+        # called on the scheduler thread
+        loop.call_soon_threadsafe(predictions.put_nowait, state)
+
+    async def send_predictions():
+        while True:
+            await websocket.send_json(await predictions.get())
+
+    scheduler.subscribe(session_id, notify)
+    sender = asyncio.create_task(send_predictions())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is None:
+                await websocket.close(code=1003)  # unsupported data: only binary PCM frames
+                break
+            scheduler.push(session_id, pcm16_to_float(message["bytes"]))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        scheduler.unsubscribe(session_id, notify)
+        sender.cancel()
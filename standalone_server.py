@@ -1,13 +1,31 @@
-from typing import List
+from typing import List, Tuple
+import json
 import os
-from fastapi import FastAPI, File, UploadFile
+import tempfile
+from fastapi import FastAPI, File, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 import aiofiles
-from vistec_ser.inference.inference import infer_sample, setup_server
+import numpy as np
+import torch
+import torch.nn.functional as F
+from vistec_ser.inference.inference import infer_sample
+from vistec_ser.utils.utils import load_yaml
+from inference_backend import setup_inference
+from audio_io import extract_feature
+from long_audio import iter_segment_predictions, predict_long_audio
+import tracing
+from batch_format import BATCH_MEDIA_TYPE, encode_batch, to_json_records
 
 config_path = "config.yaml"
+UPLOAD_CHUNK_SIZE = 1 << 20
 
 app = FastAPI()
-model, thaiser_module, temp_dir = setup_server(config_path)
+model, thaiser_module, temp_dir = setup_inference(config_path)
+inference_config = load_yaml(config_path)["inference"]
+window_hop = inference_config.get("window_hop")
+window_batch_size = inference_config.get("window_batch_size", 16)
 
 
 def clear_audio(audio_paths: List[str]) -> None:
@@ -15,31 +33,113 @@ def clear_audio(audio_paths: List[str]) -> None:
         os.remove(f)
 
 
+def sample_prob(model, sample) -> Tuple[str, torch.Tensor]:
+    """Same computation as `infer_sample`, but returns the raw probability vector."""
+    name = os.path.basename(sample[0]["emotion"][0])
+    with torch.no_grad():
+        final_logits = torch.stack([model(chunk["feature"]) for chunk in sample]).mean(dim=0)
+    return name, F.softmax(final_logits[0], dim=-1)
+
+
+async def save_uploads(audios: List[UploadFile], unique: bool = False) -> List[str]:
+    """Save uploads to `temp_dir`; with `unique`, under fresh temp names so same-named clips don't collide."""
+    audio_paths = []
+    for audio in audios:
+        print(audio.filename)
+        if unique:
+            fd, save_name = tempfile.mkstemp(suffix=os.path.splitext(audio.filename)[1], dir=temp_dir)
+            os.close(fd)
+        else:
+            save_name = f"{temp_dir}/{audio.filename}"
+        async with aiofiles.open(save_name, "wb") as f:
+            while content := await audio.read(UPLOAD_CHUNK_SIZE):
+                await f.write(content)
+        audio_paths.append(save_name)
+        assert os.path.exists(save_name)
+    return audio_paths
+
+
+def stream_segments(audio_paths: List[str]):
+    for audio_path in audio_paths:
+        for record in iter_segment_predictions(model, thaiser_module, audio_path,
+                                               hop=window_hop, batch_size=window_batch_size):
+            yield json.dumps(record) + "\n"
+
+
+def predict_long_audios(audio_paths: List[str]) -> List[dict]:
+    return [predict_long_audio(model, thaiser_module, audio_path, hop=window_hop, batch_size=window_batch_size)
+            for audio_path in audio_paths]
+
+
+def infer_batch(audio_paths: List[str]) -> Tuple[List[str], List[np.ndarray]]:
+    with tracing.span("extract_feature", n_files=len(audio_paths)):
+        inference_loader = extract_feature(thaiser_module, audio_paths)
+    names, probs = [], []
+    with tracing.span("infer_sample"):
+        for sample in inference_loader:
+            name, prob = sample_prob(model, sample)
+            names.append(name)
+            probs.append(prob.numpy())
+    return names, probs
+
+
 @app.get("/healthcheck")
 async def healthcheck():
     return {"status": "healthy"}
 
 
 @app.post("/predict")
-async def predict(audios: List[UploadFile] = File(...)):
+async def predict(audios: List[UploadFile] = File(...), long_audio: bool = False, stream: bool = False):
     """
     Predict audio POST from front-end server using `form-data` files
 
+    With `long_audio=true` each file is split into overlapping `max_len` windows that are
+    read and inferred lazily, and one clip-level result per file is returned. Adding
+    `stream=true` returns newline-delimited JSON instead: one record per window followed
+    by the clip-level record of each file.
+
     NOTE: note that this might bug if > 1 requests are sent with the same file name
     """
-    audio_paths = []
-    for audio in audios:
-        print(audio.filename)
-        save_name = f"{temp_dir}/{audio.filename}"
-        async with aiofiles.open(save_name, "wb") as f:
-            content = await audio.read()
-            await f.write(content)
-        audio_paths.append(save_name)
-        assert os.path.exists(save_name)
+    audio_paths = await save_uploads(audios)
+
+    # long recordings are inferred in the threadpool so they don't block the event loop
+    if long_audio and stream:
+        # cleanup runs as a background task, which also fires if the client disconnects
+        # before the generator is ever started
+        return StreamingResponse(stream_segments(audio_paths), media_type="application/x-ndjson",
+                                 background=BackgroundTask(clear_audio, audio_paths))
+    if long_audio:
+        try:
+            return await run_in_threadpool(predict_long_audios, audio_paths)
+        finally:
+            clear_audio(audio_paths)
 
-    inference_loader = thaiser_module.extract_feature(audio_paths)
-    inference_results = [infer_sample(model, sample, emotions=thaiser_module.emotions)
-                         for sample in inference_loader]
+    with tracing.span("extract_feature", n_files=len(audio_paths)):
+        inference_loader = extract_feature(thaiser_module, audio_paths)
+    with tracing.span("infer_sample"):
+        inference_results = [infer_sample(model, sample, emotions=thaiser_module.emotions)
+                             for sample in inference_loader]
 
     clear_audio(audio_paths)
-    return inference_results
\ No newline at end of file
+    return inference_results
+
+@app.post("/predict_batch")
+async def predict_batch(request: Request, audios: List[UploadFile] = File(...)):
+    """
+    Predict many clips in one request
+
+    Responds with the compact columnar `application/x-ser-batch` payload (see `batch_format`)
+    when the client accepts it, otherwise with the same JSON list as `/predict`.
+    """
+    audio_paths = await save_uploads(audios, unique=True)
+    upload_names = {os.path.basename(path): audio.filename for path, audio in zip(audio_paths, audios)}
+    try:
+        names, probs = await run_in_threadpool(infer_batch, audio_paths)
+    finally:
+        clear_audio(audio_paths)
+    names = [upload_names[name] for name in names]
+
+    probs = np.stack(probs) if probs else np.zeros((0, len(thaiser_module.emotions)), dtype=np.float32)
+    if BATCH_MEDIA_TYPE in request.headers.get("accept", ""):
+        return Response(content=encode_batch(names, thaiser_module.emotions, probs), media_type=BATCH_MEDIA_TYPE)
+    return to_json_records(names, thaiser_module.emotions, probs)
@@ -0,0 +1,129 @@
+"""Lightweight span tracing with Chrome/Perfetto trace export.
+
+Off by default. Set `PIPELINE_TRACE=/tmp/trace_{pid}.json` (or call `enable`) to start
+recording; spans go into an in-memory ring buffer and are written on `dump()`, on
+SIGUSR1 and at exit. Timestamps are wall-clock microseconds so traces dumped by
+different processes line up; combine them with `python tracing.py merge out.json a.json b.json`.
+
+    with tracing.span("extract_feature", file=name):
+        ...
+"""
+from collections import deque
+import atexit
+import contextlib
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+_events = None  # deque of (name, start_ns, end_ns, tid, args) while enabled
+_thread_names = {}
+_path = None
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.start, time.time_ns(), self.args)
+
+
+def _record(name, start, end, args):
+    events = _events
+    if events is None:
+        return
+    tid = threading.get_native_id()
+    if tid not in _thread_names:
+        _thread_names[tid] = threading.current_thread().name
+    events.append((name, start, end, tid, args))
+
+
+def enabled():
+    return _events is not None
+
+
+def span(name, **args):
+    """Context manager recording one complete event; a shared no-op when tracing is off."""
+    if _events is None:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def instant(name, **args):
+    """Record a zero-duration marker, e.g. a queue handoff."""
+    if _events is not None:
+        now = time.time_ns()
+        _record(name, now, now, args)
+
+
+def enable(path=None, capacity=100_000):
+    """Start recording into a ring of `capacity` events; `path` may contain `{pid}`."""
+    global _events, _path
+    _path = path.format(pid=os.getpid()) if path else None
+    if _events is None:
+        _events = deque(maxlen=capacity)
+        atexit.register(dump)
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda signum, frame: dump())
+
+
+def disable():
+    global _events
+    _events = None
+
+
+def to_chrome_events():
+    pid = os.getpid()
+    events = [{"name": "process_name", "ph": "M", "pid": pid,
+               "args": {"name": f"{os.path.basename(sys.argv[0]) or 'python'} ({pid})"}}]
+    events += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+               for tid, name in list(_thread_names.items())]
+    for name, start, end, tid, args in list(_events or ()):
+        event = {"name": name, "pid": pid, "tid": tid, "ts": start / 1000, "args": args}
+        if end == start:
+            event.update(ph="i", s="t")
+        else:
+            event.update(ph="X", dur=(end - start) / 1000)
+        events.append(event)
+    return events
+
+
+def dump(path=None):
+    """Write the current ring buffer as a Chrome trace JSON file and return its path."""
+    path = path or _path
+    if path is None or _events is None:
+        return None
+    with open(path, "w") as f:
+        json.dump({"traceEvents": to_chrome_events(), "displayTimeUnit": "ms"}, f)
+    return path
+
+
+def merge(output_path, trace_paths):
+    events = []
+    for trace_path in trace_paths:
+        with open(trace_path) as f:
+            events += json.load(f)["traceEvents"]
+    with open(output_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+if os.environ.get("PIPELINE_TRACE"):
+    enable(os.environ["PIPELINE_TRACE"])
+
+
+if __name__ == "__main__":
+    # usage: python tracing.py merge out.json trace_1.json trace_2.json ...
+    if len(sys.argv) < 4 or sys.argv[1] != "merge":
+        sys.exit("usage: python tracing.py merge out.json trace.json [trace.json ...]")
+    merge(sys.argv[2], sys.argv[3:])